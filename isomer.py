@@ -15,15 +15,18 @@ Required commands:
 
 import argparse
 import ast
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+import copy
+import functools
 import logging
 import os
-from pathlib import Path
+from pathlib import Path, PurePath
 import re
-import shutil
+import selectors
 import subprocess
 import sys
-from tempfile import TemporaryDirectory
-import time
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 __version__ = '0.9.0'
 
@@ -31,6 +34,28 @@ LOGGER = logging.getLogger('isomer')
 LOGGER.addHandler(logging.NullHandler())
 IMPLANTISOMD5 = 'implantisomd5'
 XORRISOFS = 'xorrisofs'
+XORRISOFS_ARGS = (
+    '-v',  # Verbose
+    '-follow-links',  # Resolve symlinks
+
+    # RH Recommended file options
+    '-J',  # Generate Joliet records for Windows
+    '-joliet-long',  # Support Joliet names up to 103 characters
+    '-r',  # Set file ownership and modes to sane values
+    '-U',  # Support more filenames
+)
+BIOS_BOOT_ARGS = (
+    '-b', 'isolinux/isolinux.bin',  # BIOS boot image
+    '-c', 'isolinux/boot.cat',  # El Torito boot catalog
+    '-no-emul-boot',  # Boot image for El Torito does not require emulation
+    '-boot-load-size', '4',  # Number of sectors to load of boot image
+    '-boot-info-table',  # El Torito boot table
+    '-eltorito-alt-boot',  # Finalize El Torito boot entry and start new one
+)
+EFI_BOOT_ARGS = (
+    '-e', 'images/efiboot.img',  # EFI boot image
+    '-no-emul-boot',  # Boot image for El Torito does not require emulation
+)
 KS_REL_PATH = 'ks.cfg'
 GRUB_REL_PATH = 'EFI/BOOT/grub.cfg'
 EPILOG = '''\
@@ -42,6 +67,40 @@ Flavor is evaluated in the following order:
 DESCRIPTION = 'Template-base ISO generator'
 DEF_CFG_DIR = '/etc/isomer'
 ENVIRON_CFG_DIR = 'ISOMER_CFG_DIR'
+DEF_JOBS = 8
+
+
+@contextmanager
+def _open_dir(path, dir_fd=None, flags=0):
+    """
+    Context manager for a file descriptor to a directory
+    """
+
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | flags, dir_fd=dir_fd)
+    try:
+        yield fd
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _make_dirs(parts, dir_fd):
+    """
+    Context manager for a file descriptor to a directory, creating it and any parents as needed
+
+    Parts are relative to dir_fd. Existing symlinks are never followed, so an OSError
+    is raised rather than creating anything outside of dir_fd
+    """
+
+    with ExitStack() as stack:
+        for part in parts:
+            try:
+                os.mkdir(part, mode=0o755, dir_fd=dir_fd)
+            except FileExistsError:
+                pass
+            dir_fd = stack.enter_context(_open_dir(part, dir_fd=dir_fd, flags=os.O_NOFOLLOW))
+
+        yield dir_fd
 
 
 def clean_dir(dirpath):
@@ -49,73 +108,348 @@ def clean_dir(dirpath):
     Clean directory without otherwise changing it
     """
 
-    # Delete all files and directories
-    for entry in os.scandir(dirpath):
-        if entry.is_file() or entry.is_symlink():
-            os.unlink(entry)
-        elif entry.is_dir():  # pragma: no branch
-            shutil.rmtree(entry)
+    with _open_dir(dirpath) as dir_fd:
+        _clean_dir_fd(dir_fd)
+
+
+def _clean_dir_fd(dir_fd):
+    """
+    Delete the contents of an open directory
+
+    Entries are removed relative to the directory, so paths aren't resolved for each one
+    """
+
+    # Read all entries before deleting any
+    with os.scandir(dir_fd) as entries:
+        entries = list(entries)
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            # Don't follow if the entry was replaced by a symlink
+            with _open_dir(entry.name, dir_fd=dir_fd, flags=os.O_NOFOLLOW) as child_fd:
+                _clean_dir_fd(child_fd)
+            os.rmdir(entry.name, dir_fd=dir_fd)
+        else:
+            os.unlink(entry.name, dir_fd=dir_fd)
+
+
+def _scan(root):
+    """
+    Walk a directory tree top-down with os.scandir()
+
+    Yields a tuple of the directory path relative to root, directory entries, and other entries.
+    Like os.walk(), directory entries can be removed from the list to skip them.
+    Symlinks to directories are returned with the directory entries, but aren't walked.
+    """
+
+    # Trailing separator so relative paths can be sliced from entry paths
+    root = os.path.join(root, '')
+    prefix_len = len(root)
+
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        dirs = []
+        files = []
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # Type comes from the directory listing, only symlinks need an additional stat
+                if entry.is_dir():
+                    dirs.append(entry)
+                else:
+                    files.append(entry)
+
+        yield path[prefix_len:], dirs, files
+
+        # Reversed so directories are walked in listed order
+        stack.extend(entry.path for entry in reversed(dirs) if not entry.is_symlink())
+
+
+def _translate_glob(pattern):
+    """
+    Translate a glob pattern into a regular expression string
+
+    Matches the same relative paths as pathlib.PurePath.match(). Wildcards don't cross
+    path separators and relative patterns match from the right, so a pattern can match a
+    partial path. Returns None for absolute patterns since they can't match a relative path.
+    """
+
+    pure_pattern = PurePath(pattern)
+    if not pure_pattern.parts:
+        raise ValueError(f'Empty exclude pattern: {pattern!r}')
+
+    if pure_pattern.is_absolute():
+        return None
+
+    sep = re.escape(os.sep)
+    translated = []
+    for part in pure_pattern.parts:
+        idx, length = 0, len(part)
+        res = []
+
+        while idx < length:
+            char = part[idx]
+            idx += 1
+
+            if char == '*':
+                res.append(f'[^{sep}]*')
+
+            elif char == '?':
+                res.append(f'[^{sep}]')
+
+            elif char == '[':
+                regex, idx = _translate_set(part, idx, sep)
+                res.append(regex)
+
+            else:
+                res.append(re.escape(char))
+
+        translated.append(''.join(res))
+
+    return f'(?:^|{sep}){sep.join(translated)}\\Z'
+
+
+def _translate_set(part, idx, sep):
+    """
+    Translate a glob character set, idx is the index after the opening bracket
+
+    Returns the regular expression and the index after the set
+    Follows fnmatch.translate(), except sets never match a path separator
+    """
+
+    length = len(part)
+    end = idx
+    if end < length and part[end] == '!':
+        end += 1
+    if end < length and part[end] == ']':
+        end += 1
+    while end < length and part[end] != ']':
+        end += 1
+
+    # No closing bracket, treat as a literal
+    if end >= length:
+        return '\\[', idx
+
+    stuff = _escape_set(part[idx:end])
+
+    # Empty range never matches
+    if not stuff:
+        return '(?!)', end + 1
+
+    # Negated empty range matches any character
+    if stuff == '!':
+        return f'[^{sep}]', end + 1
 
+    if stuff[0] == '!':
+        stuff = '^' + stuff[1:]
+    elif stuff[0] == '^':
+        stuff = '\\' + stuff
 
-def _get_details(node, configfile):
+    return f'(?!{sep})[{stuff}]', end + 1
+
+
+def _escape_set(stuff):
+    """
+    Escape the contents of a glob character set for a regular expression set
+
+    Like fnmatch.translate(), empty ranges are removed and hyphens that don't form
+    ranges are escaped, so sets that fnmatch accepts always compile
+    """
+
+    # Split into chunks around hyphens that form ranges
+    chunks = []
+    start = 0
+    pos = 2 if stuff[0] == '!' else 1
+    while (pos := stuff.find('-', pos)) >= 0:
+        chunks.append(stuff[start:pos])
+        start = pos + 1
+        pos += 3
+
+    if chunk := stuff[start:]:
+        chunks.append(chunk)
+    else:
+        chunks[-1] += '-'
+
+    # Remove empty ranges, they are invalid in regular expressions
+    for pos in range(len(chunks) - 1, 0, -1):
+        if chunks[pos - 1][-1] > chunks[pos][0]:
+            chunks[pos - 1] = chunks[pos - 1][:-1] + chunks[pos][1:]
+            del chunks[pos]
+
+    # Escape backslashes and hyphens that aren't ranges
+    stuff = '-'.join(chunk.replace('\\', '\\\\').replace('-', '\\-') for chunk in chunks)
+
+    # Escape characters reserved for nested sets and set operations
+    return re.sub(r'([&~|\[])', r'\\\1', stuff)
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_excludes(patterns):
+    """
+    Compile a tuple of exclude patterns into a single regular expression
+
+    Returns None if no patterns can match
+    Results are cached, so repeated builds with the same patterns don't translate them again
+    """
+
+    translated = [regex for regex in map(_translate_glob, patterns) if regex is not None]
+    if not translated:
+        return None
+
+    return re.compile('|'.join(f'(?:{regex})' for regex in translated))
+
+
+def _escape_graft(path):
+    """
+    Escape a path for use in a xorrisofs graft point
+    """
+
+    path = os.fspath(path)
+    if '\n' in path:
+        raise ValueError(f'Unable to graft path containing a newline: {path!r}')
+
+    return path.replace('\\', '\\\\').replace('=', '\\=')
+
+
+def _get_details(node, configfile, text):
     """
     Generate a SyntaxError-compatible details tuple
     """
 
     if sys.version_info[:2] >= (3, 10):  # pragma: no branch
-        return (configfile, node.lineno, node.col_offset,
-                ast.get_source_segment(configfile.read_text('utf-8'), node),
+        return (configfile, node.lineno, node.col_offset, ast.get_source_segment(text, node),
                 node.end_lineno, node.end_col_offset)
 
     return (configfile, node.lineno, node.col_offset,  # pragma: no cover
-            ast.get_source_segment(configfile.read_text('utf-8'), node))
+            ast.get_source_segment(text, node))
 
 
-def parse_cfg(configfile):
+class _ConfigParser(ast.NodeVisitor):
     """
-    Parse configuration file
+    Evaluate the top-level statements of a parsed configuration file
+
+    Statements are stored in order as (name, value) tuples in the statements attribute
+    Included files have a name of None and the path as given for the value
     """
 
-    configfile = Path(configfile)
-    if not configfile.is_file():
-        raise ValueError(f'Unable to locate config file at {configfile}')
+    def __init__(self, configfile, text):
+
+        self.configfile = configfile
+        self.text = text
+        self.statements = []
+
+    def visit_Module(self, node):  # pylint: disable=invalid-name
+        """
+        Visit top-level statements
+        """
+
+        for child in node.body:
+            self.visit(child)
+
+    def visit_Assign(self, node):  # pylint: disable=invalid-name
+        """
+        Assignment nodes
+        """
+
+        # Attempt to evaluate to literal type, once for all targets
+        try:
+            value = ast.literal_eval(node.value)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError) as e:
+            raise SyntaxError(
+                f'Unsupported syntax (Non-literal): {e}',
+                _get_details(node, self.configfile, self.text)
+            ) from None
+
+        for target in node.targets:
+            if not isinstance(target, ast.Name):
+                raise SyntaxError('Unsupported syntax (Invalid name)',
+                                  _get_details(node, self.configfile, self.text))
+
+            self.statements.append((target.id, value))
+
+    def visit_Expr(self, node):  # pylint: disable=invalid-name
+        """
+        Expression nodes, only 'include' calls are supported
+        """
+
+        if not (isinstance(node.value, ast.Call) and
+                getattr(node.value.func, 'id', None) == 'include'):
+            self.generic_visit(node)
+
+        for arg in node.value.args:
+
+            if not isinstance(arg, ast.Constant):
+                raise SyntaxError('Unsupported syntax (Missing quotes?)',
+                                  _get_details(node, self.configfile, self.text))
+
+            self.statements.append((None, arg.value))
+
+    def generic_visit(self, node):
+        """
+        Any other nodes are unsupported
+        """
+
+        raise SyntaxError('Unsupported syntax', _get_details(node, self.configfile, self.text))
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_cfg_file(path, mtime_ns, size):  # pylint: disable=unused-argument
+    """
+    Parse a single configuration file into a tuple of statements
+
+    Modification time and size are only used as part of the cache key,
+    so a file is parsed again when it changes
+    """
+
+    configfile = Path(path)
+
+    # Read once, text is reused for error details
+    text = configfile.read_text('utf-8')
 
     # This will raise a Syntax Error if file has bad syntax
-    parsed = ast.parse(configfile.read_text('utf-8'), filename=configfile, mode='exec')
+    parsed = ast.parse(text, filename=path, mode='exec')
 
-    rtn = {}
-    for node in parsed.body:
+    parser = _ConfigParser(configfile, text)
+    parser.visit(parsed)
 
-        # Look for assignment nodes
-        if isinstance(node, ast.Assign):
-            for target in node.targets:
-                # Attempt to evaluate to literal type
-                try:
-                    rtn[target.id] = ast.literal_eval(node.value)
-                except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError) as e:
-                    raise SyntaxError(
-                        f'Unsupported syntax (Non-literal): {e}', _get_details(node, configfile)
-                    ) from None
+    return tuple(parser.statements)
 
-            continue
 
-        # Check for 'include' call
-        if (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and
-                node.value.func.id == 'include'):
-            for arg in node.value.args:
+def parse_cfg(configfile):
+    """
+    Parse configuration file
+    """
 
-                if not isinstance(arg, ast.Constant):
-                    raise SyntaxError('Unsupported syntax (Missing quotes?)',
-                                      _get_details(node, configfile))
+    configfile = Path(configfile)
+    if not configfile.is_file():
+        raise ValueError(f'Unable to locate config file at {configfile}')
+
+    # Parsed files are cached, so files included more than once are only parsed once
+    resolved = configfile.resolve()
+    stat = resolved.stat()
 
-                include_file = Path(arg.value)
-                if not include_file.is_absolute():
-                    include_file = configfile.parent / include_file
-                rtn.update(parse_cfg(include_file))
+    try:
+        statements = _parse_cfg_file(str(resolved), stat.st_mtime_ns, stat.st_size)
+    except SyntaxError as e:
+        # Report the path as given, the resolved path is only for the cache
+        e.filename = os.fspath(configfile)
+        raise
 
-            continue
+    rtn = {}
+    for name, value in statements:
+
+        # Included file, relative paths are relative to the directory of this file
+        if name is None:
+            include_file = Path(value)
+            if not include_file.is_absolute():
+                include_file = configfile.parent / include_file
+            rtn.update(parse_cfg(include_file))
 
-        raise SyntaxError('Unsupported syntax', _get_details(node, configfile))
+        # Copy so cached values aren't modified by the caller
+        # Targets of the same assignment also get separate values
+        else:
+            rtn[name] = copy.deepcopy(value)
 
     return rtn
 
@@ -125,7 +459,8 @@ class ISO:  # pylint: disable=too-many-instance-attributes,too-many-arguments
     Class for creating ISOs
     """
 
-    def __init__(self, source, outfile, config, working=None, quiet=False, volume_id=None):
+    def __init__(self, source, outfile, config, working=None, quiet=False, volume_id=None,
+                 jobs=DEF_JOBS, path_list=False, checksum_runner=None):
 
         # Source to base new ISO on
         self.source = Path(source)
@@ -150,15 +485,44 @@ class ISO:  # pylint: disable=too-many-instance-attributes,too-many-arguments
         # Logging level
         self.quiet = quiet
 
+        # Number of threads used to create symlinks
+        self.jobs = jobs
+        if not isinstance(self.jobs, int) or self.jobs < 1:
+            raise ValueError(f'jobs must be a positive integer: {self.jobs}')
+
+        # Graft files into the ISO with a path list rather than linking them
+        # {iso_path: target}
+        self.path_list = path_list
+        self.grafts = {}
+
+        # Callable taking the output filename and returning a return code
+        # Default is resolved when called, storing a bound method would create a reference cycle
+        self._checksum_runner = checksum_runner
+
         # Store initial volume_id
         self.volume_id = volume_id
 
         # Parse flavor configuration
         self.parse_config(config)
 
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.cleanup()
+
     def __del__(self):
 
-        # Make sure temp directories get cleaned
+        # Fallback in case cleanup() wasn't called
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Remove temporary working directory, if one was created
+        """
+
         if hasattr(self, '_working'):
             self._working.cleanup()
 
@@ -241,62 +605,128 @@ class ISO:  # pylint: disable=too-many-instance-attributes,too-many-arguments
 
         # Make sure directory is empty
         clean_dir(self.working)
+        self.grafts = {}
+
+        # Match all exclude patterns with a single regular expression
+        exclude_re = _compile_excludes(tuple(self.exclude))
+
+        # Included paths are removed as they're found, any remaining are added after the walk
+        # Lookups are skipped once all have been found
+        include = dict(self.include)
+
+        # Relative paths are sliced from entry paths rather than computed with pathlib
+        src_prefix_len = len(os.path.join(self.source, ''))
+
+        # Links and directories are created relative to an open working directory
+        # so the kernel doesn't resolve the full path for each one
+        # Symlinks are created in parallel since each one is bound by syscall latency
+        # No threads are started for a single job or when files are grafted instead
+        executor = (
+            ThreadPoolExecutor(max_workers=self.jobs)
+            if self.jobs > 1 and not self.path_list else None
+        )
+        with executor or nullcontext(), _open_dir(self.working) as working_fd:
+
+            # Walk source recursively
+            for rel_dir, dirs, files in _scan(self.source):
+                with _open_dir(rel_dir or '.', dir_fd=working_fd) as dir_fd:
+                    link_targets, link_names = self._populate_dir(
+                        dir_fd, dirs, files,
+                        prefix_len=src_prefix_len, exclude_re=exclude_re, include=include
+                    )
+
+                    # Create symlinks, must finish before directory is closed
+                    # Subdirectories are created first, so they don't conflict
+                    symlink = functools.partial(os.symlink, dir_fd=dir_fd)
+                    for _ in (executor.map if executor else map)(symlink, link_targets, link_names):
+                        pass
+
+            # Handle any additional included files
+            for relative_path, target in include.items():
+                self._link_include(working_fd, relative_path, target)
 
-        # Walk source recursively
-        for root, dirs, files in os.walk(self.source):
-            root_path = Path(root)
-
-            # Iterate directories
-            for dirname in dirs[:]:
-                dirpath = root_path / dirname
-                relative_path = dirpath.relative_to(self.source)
-
-                # Check if directory is excluded
-                if any(map(relative_path.match, self.exclude)):
-                    dirs.remove(dirname)
-                    LOGGER.info('Excluded directory: %s', dirpath)
-                    continue
-
-                if target := self.include.pop(str(relative_path), None):
-                    dirs.remove(dirname)
-                    (self.working / relative_path).symlink_to(target)
-                    LOGGER.info('%s -> %s', relative_path, target)
-                    continue
+        if self.grub_template:
+            self.generate_grub()
 
-                # Create directory
-                (self.working / relative_path).mkdir(mode=0o755)
-                LOGGER.info('Created directory: %s', relative_path)
+    def _populate_dir(self, dir_fd, dirs, files, *, prefix_len, exclude_re, include):
+        """
+        Populate a single working directory from the entries of a source directory
 
-            # Iterate files
-            for filepath in (root_path / filename for filename in files):
-                relative_path = filepath.relative_to(self.source)
+        Directories are created, skipped directories are removed from dirs,
+        and found includes are removed from include.
+        Returns link targets and names to be created in the directory
+        """
 
-                # Check if file is excluded
-                if any(map(relative_path.match, self.exclude)):
-                    LOGGER.info('Excluded file: %s', filepath)
-                    continue
+        link_targets = []
+        link_names = []
+
+        # Iterate directories
+        for entry in dirs[:]:
+            relative_path = entry.path[prefix_len:]
+
+            # Check if directory is excluded
+            if exclude_re and exclude_re.search(relative_path):
+                dirs.remove(entry)
+                LOGGER.info('Excluded directory: %s', entry.path)
+                continue
+
+            if include and (target := include.pop(relative_path, None)):
+                dirs.remove(entry)
+                if self.path_list:
+                    self.grafts[relative_path] = target
+                else:
+                    os.symlink(target, entry.name, dir_fd=dir_fd)
+                LOGGER.info('%s -> %s', relative_path, target)
+                continue
+
+            # Create directory
+            os.mkdir(entry.name, mode=0o755, dir_fd=dir_fd)
+            LOGGER.info('Created directory: %s', relative_path)
+
+        # Iterate files
+        for entry in files:
+            relative_path = entry.path[prefix_len:]
+
+            # Check if file is excluded
+            if exclude_re and exclude_re.search(relative_path):
+                LOGGER.info('Excluded file: %s', entry.path)
+                continue
+
+            # Check if file is overridden
+            target = include.pop(relative_path, entry.path) if include else entry.path
+
+            # Queue symlink or graft
+            if self.path_list:
+                self.grafts[relative_path] = target
+            else:
+                link_targets.append(target)
+                link_names.append(entry.name)
+            LOGGER.info('%s -> %s', relative_path, target)
 
-                # Check if file is overridden
-                target = self.include.pop(str(relative_path), filepath)
+        return link_targets, link_names
 
-                # Create symlink
-                (self.working / relative_path).symlink_to(target)
-                LOGGER.info('%s -> %s', relative_path, target)
+    @staticmethod
+    def _link_include(working_fd, relative_path, target):
+        """
+        Link an included file that wasn't found in source, creating directories as needed
 
-        # Handle any additional included files
-        for source, target in self.include.items():
-            working_path = self.working / source
-            relative_path = working_path.relative_to(self.working)
+        Links in working are never followed, so an OSError is raised rather than creating
+        anything through them
+        """
 
-            # Create directory, if needed
-            working_path.parent.mkdir(mode=0o755, parents=True, exist_ok=True)
+        # Paths outside of working are never created
+        path = PurePath(relative_path)
+        if path.is_absolute() or not path.parts or '..' in path.parts:
+            raise ValueError(f'Unable to include {relative_path}: Invalid path')
 
-            # Create symlink
-            LOGGER.info('%s -> %s', relative_path, target)
-            working_path.symlink_to(target)
+        *parents, name = path.parts
+        try:
+            with _make_dirs(parents, working_fd) as dir_fd:
+                os.symlink(target, name, dir_fd=dir_fd)
+        except OSError as e:
+            raise OSError(e.errno, f'Unable to include {relative_path}: {e.strerror}') from e
 
-        if self.grub_template:
-            self.generate_grub()
+        LOGGER.info('%s -> %s', relative_path, target)
 
     def gen_iso(self):
         """
@@ -305,79 +735,125 @@ class ISO:  # pylint: disable=too-many-instance-attributes,too-many-arguments
 
         args = [
             XORRISOFS,  # Command
-            '-v',  # Verbose
-            '-follow-links',  # Resolve symlinks
-
-            # RH Recommended file options
-            '-J',  # Generate Joliet records for Windows
-            '-joliet-long',  # Support Joliet names up to 103 characters
-            '-r',  # Set file ownership and modes to sane values
-            '-U',  # Support more filenames
+            *XORRISOFS_ARGS,
 
             # RH Recommended Metadata
             # '-A', self.volume_id,  # Application ID (not set in RHEL 9 ISO)
             '-V', self.volume_id,  # Volume ID
             # '-volset', self.volume_id,  # Volume Set ID (not set in RHEL 9 ISO)
-
         ]
 
         # BIOS Boot - Disable by default
         if self.bios_boot:
-            args.extend([
-                '-b', 'isolinux/isolinux.bin',  # BIOS boot image
-                '-c', 'isolinux/boot.cat',  # El Torito boot catalog
-                '-no-emul-boot',  # Boot image for El Torito does not require emulation
-                '-boot-load-size', '4',  # Number of sectors to load of boot image
-                '-boot-info-table',  # El Torito boot table
-                '-eltorito-alt-boot',  # Finalize El Torito boot entry and start new one
-            ])
+            args += BIOS_BOOT_ARGS
 
         # EFI Boot
         if self.efi_boot:
-            args.extend([
-                '-e', 'images/efiboot.img',  # EFI boot image
-                '-no-emul-boot',  # Boot image for El Torito does not require emulation
-            ])
+            args += EFI_BOOT_ARGS
 
-        args.extend([
-            '-o', str(self.outfile),  # Output file
-            str(self.working),  # source directory
-        ])
+        # Grafted files are read from a path list
+        path_list = self._write_path_list() if self.path_list else nullcontext(())
 
-        LOGGER.info('Running command: %s', {" ".join(args)})
-        kwargs = {'stdout': subprocess.DEVNULL} if self.quiet else {}
+        with path_list as path_list_args:
+            args += (
+                *path_list_args,
+                '-o', os.fspath(self.outfile),  # Output file
+                os.fspath(self.working),  # source directory
+            )
 
-        try:
-            subprocess.run(args, check=True, **kwargs)
-        except subprocess.CalledProcessError as e:
-            LOGGER.error('Failed to generate ISO: %s', e)
-            return False
+            LOGGER.info('Running command: %s', {" ".join(args)})
+            kwargs = {'stdout': subprocess.DEVNULL} if self.quiet else {}
+
+            try:
+                subprocess.run(args, check=True, **kwargs)
+            except subprocess.CalledProcessError as e:
+                LOGGER.error('Failed to generate ISO: %s', e)
+                return False
 
         return True
 
+    @contextmanager
+    def _write_path_list(self):
+        """
+        Context manager for a temporary xorrisofs path list of grafted files
+
+        Yields the xorrisofs arguments for the path list
+        """
+
+        with NamedTemporaryFile(
+            'w', encoding='utf-8', prefix='isomer_', suffix='.lst'
+        ) as path_list:
+            for iso_path, target in self.grafts.items():
+                path_list.write(f'{_escape_graft(iso_path)}={_escape_graft(target)}\n')
+            path_list.flush()
+
+            yield (
+                '-graft-points',  # Allow paths in the form iso_path=disk_path
+                '-path-list', path_list.name,  # Read paths from file
+            )
+
     def implant_checksum(self):
         """
         Implant checksum in ISO.
         Used MD5 because it's an old spec
         """
 
-        args = (IMPLANTISOMD5, str(self.outfile))
+        runner = self._checksum_runner or self._run_implantisomd5
+        returncode = runner(os.fspath(self.outfile))
+        if returncode:
+            LOGGER.error('Failed to implant checksum (returncode: %d)', returncode)
+
+        return not returncode
+
+    def _run_implantisomd5(self, outfile):
+        """
+        Default checksum runner, implant checksum with implantisomd5
+        """
+
+        args = (IMPLANTISOMD5, outfile)
         LOGGER.info('Running command: %s', {" ".join(args)})
-        if not self.quiet:
+
+        if self.quiet:
+            kwargs = {'stdout': subprocess.DEVNULL}
+        else:
             print('Calculating md5sum: ', end='', flush=True)
-        kwargs = {'stdout': subprocess.DEVNULL} if self.quiet else {}
+            kwargs = {'stdout': subprocess.PIPE, 'bufsize': 0}
+
         with subprocess.Popen(args, **kwargs) as process:
 
-            # The process doesn't give status when calculating, so wrap so we know it's working
-            while process.poll() is None:
-                if not self.quiet:
+            # Nothing to show when quiet, so block until exit
+            if self.quiet:
+                process.wait()
+            else:
+                self._show_progress(process)
+
+        return process.returncode
+
+    @staticmethod
+    def _show_progress(process):
+        """
+        Relay process output until it exits, printing dots while it's quiet
+
+        The process doesn't give status when calculating, so wrap so we know it's working
+        Waiting on the output pipe rather than sleeping means exit is detected immediately
+        """
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ)
+
+            while True:
+                if not selector.select(timeout=0.5):
                     print('.', end='', flush=True)
-                time.sleep(0.5)
+                    continue
 
-            if process.returncode:
-                LOGGER.error('Failed to implant checksum (returncode: %d)', process.returncode)
+                # Empty read means the pipe was closed
+                output = process.stdout.read(4096)
+                if not output:
+                    break
 
-            return not process.returncode
+                print(output.decode('utf-8', errors='replace'), end='', flush=True)
+
+        process.wait()
 
     def generate(self):
         """
@@ -398,15 +874,17 @@ class ISO:  # pylint: disable=too-many-instance-attributes,too-many-arguments
         """
 
         LOGGER.info('Generating boot menu: %s', GRUB_REL_PATH)
-        grub_path = self.working / GRUB_REL_PATH
-        if not grub_path.parent.exists():
-            grub_path.parent.mkdir(parents=True, mode=0o755, exist_ok=True)
 
-        with grub_path.open('w') as grub:
-            try:
-                grub.write(self.grub_template.format_map(self.fields))
-            except KeyError as e:
-                LOGGER.error("Unknown field %s in grub_template: %s", e, self.grub_template)
+        # Format before opening, so a bad template doesn't leave an empty file
+        try:
+            grub_cfg = self.grub_template.format_map(self.fields)
+        except KeyError as e:
+            LOGGER.error("Unknown field %s in grub_template: %s", e, self.grub_template)
+            return
+
+        grub_path = self.working / GRUB_REL_PATH
+        grub_path.parent.mkdir(parents=True, mode=0o755, exist_ok=True)
+        grub_path.write_text(grub_cfg)
 
 
 def get_config_file(flavor: Path):
@@ -450,6 +928,11 @@ def cli(args=None):
                         help='Working directory, contents overwritten')
     parser.add_argument('-q', '--quiet', action='store_true', default=False,
                         help='Suppress output')
+    parser.add_argument('-p', '--path-list', action='store_true', default=False,
+                        help='Graft files into ISO with a path list rather than linking them')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=DEF_JOBS,
+                        help='Number of threads used to create links, '
+                        f'only helps on high-latency filesystems (Default: {DEF_JOBS})')
 
     options = parser.parse_args(args)
 
@@ -471,7 +954,8 @@ def cli(args=None):
     # Create class instance and generate ISO
     kwargs = vars(options)
     del kwargs['flavor']
-    ISO(config=config, **kwargs).generate()
+    with ISO(config=config, **kwargs) as iso:
+        iso.generate()
 
 
 if __name__ == '__main__':
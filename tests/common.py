@@ -9,8 +9,9 @@ Common test data and utilities
 """
 
 from contextlib import contextmanager
+import functools
 import os
-from pathlib import Path
+from pathlib import Path, PurePath
 import tempfile
 
 TESTDATA = Path(__file__).parent / 'testdata'
@@ -55,59 +56,76 @@ def write_temp_file(text):
     return temp
 
 
-def compare_dirs(src: Path, dest: Path):
+def _walk(root, descend=None):
     """
-    Compare source and destination directories
+    Walk a directory with os.scandir(), yielding (relative_path, DirEntry) tuples
+
+    Parents are yielded before their contents. Symlinks are not followed.
+    If descend is given, directories are only walked when descend(relative_path) is True
     """
 
-    src_only = []
-    differ = []
+    stack = [(root, PurePath())]
 
-    for root, dirs, files in os.walk(src):
-        root_path = Path(root)
+    while stack:
+        path, rel_root = stack.pop()
 
-        for dirname in dirs[:]:
-            entry_src = root_path / dirname
-            rel_path = entry_src.relative_to(src)
-            entry_dest = dest / rel_path
+        with os.scandir(path) as entries:
+            for entry in entries:
+                rel_path = rel_root / entry.name
+                yield rel_path, entry
 
-            if not entry_dest.exists():
-                src_only.append(str(rel_path))
+                if entry.is_dir(follow_symlinks=False) and (descend is None or descend(rel_path)):
+                    stack.append((entry.path, rel_path))
 
-            elif entry_dest.is_symlink() or not entry_dest.is_dir():
-                differ.append(str(rel_path))
-                dirs.remove(dirname)
 
-        for filename in files:
-            entry_src = root_path / filename
-            rel_path = entry_src.relative_to(src)
-            entry_dest = dest / rel_path
+@functools.lru_cache(maxsize=None)
+def _snapshot(path: Path):
+    """
+    Snapshot of directory contents as {relative_path: is_dir}, parents before contents
 
-            if not entry_dest.exists():
-                src_only.append(str(rel_path))
+    Source directories don't change during tests, so each is only walked once
+    """
 
-            elif not entry_dest.is_symlink() or Path(os.readlink(entry_dest)) != entry_src:
-                differ.append(str(rel_path))
+    return {rel_path: entry.is_dir() for rel_path, entry in _walk(path)}
+
+
+def compare_dirs(src: Path, dest: Path):
+    """
+    Compare source and destination directories
+    """
+
+    snapshot = _snapshot(src)
 
+    # Only walk destination directories that are also in the source
     dest_only = []
-    for root, dirs, files in os.walk(dest):
-        root_path = Path(root)
+    dest_entries = {}
+    for rel_path, entry in _walk(dest, descend=snapshot.__contains__):
+        if rel_path in snapshot:
+            dest_entries[rel_path] = entry
+        else:
+            dest_only.append(str(rel_path))
 
-        for dirname in dirs[:]:
-            entry_dest = root_path / dirname
-            rel_path = entry_dest.relative_to(dest)
-            entry_src = src / rel_path
+    src_only = []
+    differ = []
+
+    # Contents of differing directories are not compared
+    pruned = set()
+
+    for rel_path, is_dir in snapshot.items():
+        if not pruned.isdisjoint(rel_path.parents):
+            continue
 
-            if not entry_src.exists():
-                dest_only.append(str(rel_path))
-                dirs.remove(dirname)
+        entry_dest = dest_entries.get(rel_path)
 
-        for filename in files:
-            entry_dest = root_path / filename
-            rel_path = entry_dest.relative_to(dest)
-            entry_src = src / rel_path
+        if entry_dest is None:
+            src_only.append(str(rel_path))
+
+        elif is_dir:
+            if not entry_dest.is_dir(follow_symlinks=False):
+                differ.append(str(rel_path))
+                pruned.add(rel_path)
 
-            if not entry_src.exists():
-                dest_only.append(str(rel_path))
+        elif not entry_dest.is_symlink() or Path(os.readlink(entry_dest)) != src / rel_path:
+            differ.append(str(rel_path))
 
     return differ, src_only, dest_only
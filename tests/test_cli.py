@@ -61,3 +61,23 @@ class TestCLI(unittest.TestCase):
         with patch('isomer.ISO') as mock_iso:
             isomer.cli(['-f', str(FLAVOR_PATH), '-s', str(TEST_SRC), '-o', 'test.iso'])
             self.assertEqual(mock_iso.call_args.kwargs['config'], FLAVOR_CONFIG)
+            self.assertEqual(mock_iso.call_args.kwargs['jobs'], isomer.DEF_JOBS)
+            mock_iso.return_value.__enter__.return_value.generate.assert_called_once()
+            mock_iso.return_value.__exit__.assert_called_once()
+
+    def test_jobs(self):
+        """Number of jobs provided"""
+
+        with patch('isomer.ISO') as mock_iso:
+            isomer.cli(['-f', str(FLAVOR_PATH), '-s', str(TEST_SRC), '-o', 'test.iso', '-j', '2'])
+            self.assertEqual(mock_iso.call_args.kwargs['jobs'], 2)
+
+    def test_path_list(self):
+        """Path list enabled"""
+
+        with patch('isomer.ISO') as mock_iso:
+            isomer.cli(['-f', str(FLAVOR_PATH), '-s', str(TEST_SRC), '-o', 'test.iso'])
+            self.assertFalse(mock_iso.call_args.kwargs['path_list'])
+
+            isomer.cli(['-f', str(FLAVOR_PATH), '-s', str(TEST_SRC), '-o', 'test.iso', '-p'])
+            self.assertTrue(mock_iso.call_args.kwargs['path_list'])
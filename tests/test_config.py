@@ -8,8 +8,10 @@
 Test related to configuration file locating and parsing
 """
 
+import ast
 import os
 from pathlib import Path
+from tempfile import TemporaryDirectory
 import unittest
 from unittest.mock import patch
 
@@ -52,6 +54,19 @@ class TestGetConfigFile(unittest.TestCase):
 
         self.assertIsNone(isomer.get_config_file(Path('flavor')))
 
+    def test_not_cached(self):
+        """Files created or removed between lookups are found or not found"""
+
+        with TemporaryDirectory(prefix='isomer_test_') as cfg_dir, set_directory(cfg_dir):
+            self.assertIsNone(isomer.get_config_file(Path('flavor')))
+
+            cfg = Path(cfg_dir) / 'flavor.cfg'
+            cfg.touch()
+            self.assertEqual(isomer.get_config_file(Path('flavor')), Path.cwd() / 'flavor.cfg')
+
+            cfg.unlink()
+            self.assertIsNone(isomer.get_config_file(Path('flavor')))
+
 
 class TestParseCfg(unittest.TestCase):
     """
@@ -96,9 +111,120 @@ class TestParseCfg(unittest.TestCase):
         with self.assertRaisesRegex(SyntaxError, 'Non-literal'):
             isomer.parse_cfg(configfile.name)
 
+    def test_read_once(self):
+        """File is only read once, even when generating error details"""
+
+        with write_temp_file('foo = 1\nbar = baz()\n') as configfile, \
+                patch('pathlib.Path.read_text', autospec=True, side_effect=Path.read_text) as read:
+            with self.assertRaisesRegex(SyntaxError, 'Non-literal') as cm:
+                isomer.parse_cfg(configfile.name)
+
+        read.assert_called_once()
+        self.assertEqual(cm.exception.text, 'bar = baz()')
+        self.assertEqual(cm.exception.lineno, 2)
+
+    def test_error_filename(self):
+        """Errors report the path as given, not the resolved path"""
+
+        for text in ('foo)\n', 'foo = bar()\n'):
+            with self.subTest(text=text), TemporaryDirectory(prefix='isomer_test_') as tempdir:
+                tempdir = Path(tempdir)
+                (tempdir / 'real.cfg').write_text(text, encoding='utf-8')
+                (tempdir / 'link.cfg').symlink_to(tempdir / 'real.cfg')
+                (tempdir / 'main.cfg').write_text("include('link.cfg')\n", encoding='utf-8')
+
+                for configfile, expected in (
+                    (tempdir / 'link.cfg', tempdir / 'link.cfg'),
+                    (tempdir / 'main.cfg', tempdir / 'link.cfg'),
+                ):
+                    with self.assertRaises(SyntaxError) as cm:
+                        isomer.parse_cfg(configfile)
+                    self.assertEqual(cm.exception.filename, str(expected))
+
+    def test_cached(self):
+        """Files are only parsed again when changed"""
+
+        configfile = write_temp_file("include = {'foo': 'bar'}\n")
+
+        with patch('pathlib.Path.read_text', autospec=True, side_effect=Path.read_text) as read:
+            config = isomer.parse_cfg(configfile.name)
+            self.assertEqual(config, {'include': {'foo': 'bar'}})
+
+            # Modifying result doesn't modify cache
+            config['include']['spam'] = 'eggs'
+            self.assertEqual(isomer.parse_cfg(configfile.name), {'include': {'foo': 'bar'}})
+            read.assert_called_once()
+
+            # File changed
+            configfile.truncate()
+            configfile.write("answer = 42\n")
+            configfile.flush()
+            self.assertEqual(isomer.parse_cfg(configfile.name), {'answer': 42})
+            self.assertEqual(read.call_count, 2)
+
+    def test_literals(self):
+        """Same values are supported as ast.literal_eval()"""
+
+        supported = (
+            "'foo'", "b'foo'", '42', '-42', '+4.2', '1+2j', '-1-2j', 'True', 'None', '...',
+            '(1, 2)', "[1, 'two']", '{1, 2}', "{'foo': [1, {'bar': (2,)}]}", 'set()', '()',
+        )
+        for value in supported:
+            with self.subTest(value=value), write_temp_file(f'foo = {value}\n') as configfile:
+                self.assertEqual(
+                    isomer.parse_cfg(configfile.name), {'foo': ast.literal_eval(value)}
+                )
+
+        unsupported = (
+            'bar', 'bar()', "'a' + 'b'", '-True', '--1', '1 + 2', '2j + 1', '[*bar]',
+            '{**bar}', 'set([1])', '(lambda: 1)', '[i for i in ()]', 'foo.bar',
+            '{[1]: 2}', '{1, [2]}',
+        )
+        for value in unsupported:
+            with self.subTest(value=value), write_temp_file(f'foo = {value}\n') as configfile:
+                with self.assertRaisesRegex(SyntaxError, 'Non-literal') as cm:
+                    isomer.parse_cfg(configfile.name)
+
+                self.assertEqual(cm.exception.lineno, 1)
+
+    def test_shadowed_set(self):
+        """Assigning to set doesn't change set()"""
+
+        with write_temp_file('set = 1\nfoo = set()\n') as configfile:
+            self.assertEqual(isomer.parse_cfg(configfile.name), {'set': 1, 'foo': set()})
+
+    def test_multiple_targets(self):
+        """Each target gets its own value"""
+
+        configfile = write_temp_file('foo = bar = []\n')
+        config = isomer.parse_cfg(configfile.name)
+        self.assertEqual(config, {'foo': [], 'bar': []})
+        self.assertIsNot(config['foo'], config['bar'])
+
+    def test_invalid_name(self):
+        """Assignment to something other than a name"""
+
+        for text in ('foo.bar = 1\n', 'foo, bar = 1, 2\n'):
+            with self.subTest(text=text):
+                configfile = write_temp_file(text)
+                with self.assertRaisesRegex(SyntaxError, 'Invalid name'):
+                    isomer.parse_cfg(configfile.name)
+
     def test_include_no_quotes(self):
         """include() passed a name instead of a string"""
 
         configfile = write_temp_file('include(filename)\n')
         with self.assertRaisesRegex(SyntaxError, 'Missing quotes'):
             isomer.parse_cfg(configfile.name)
+
+    def test_unsupported_call(self):
+        """File contains a call to a function other than include()"""
+
+        for text in ('exclude("foo")\n', 'os.remove("foo")\n'):
+            with self.subTest(text=text):
+                configfile = write_temp_file(text)
+                with self.assertRaisesRegex(SyntaxError, 'Unsupported syntax') as cm:
+                    isomer.parse_cfg(configfile.name)
+
+                self.assertEqual(cm.exception.text, text.strip())
+                self.assertEqual(cm.exception.lineno, 1)
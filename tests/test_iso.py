@@ -8,31 +8,110 @@
 Test related to the ISO class
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import redirect_stdout
+import copy
 import functools
 from io import StringIO
 import logging
 import os
-from pathlib import Path
+from pathlib import Path, PurePath
+import re
+import selectors
 import subprocess
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, mkdtemp
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import isomer
+from isomer import DEF_JOBS, GRUB_REL_PATH, ISO, KS_REL_PATH, LOGGER, clean_dir
 from tests.common import FLAVOR2_PATH, FLAVOR_PATH, KICKSTART, TESTDATA, TEST_SRC, compare_dirs
 
+# Expected error messages
+RE_NO_DIR = re.compile('directory does not exist')
+RE_JOBS = re.compile('jobs must be a positive integer')
+RE_NOT_DICT = re.compile('must be a dict')
+RE_NO_VOLUME_ID = re.compile("Missing required field: 'volume_id'")
+RE_VOLUME_ID_TYPE = re.compile('volume_id must be a str')
+RE_WHITESPACE = re.compile('contains whitespace')
+RE_NOT_FOUND = re.compile('Unable to find')
+RE_UNSUPPORTED = re.compile('Ignoring unsupported fields in flavor configuration: foo, spam')
+RE_CHECKSUM_FAILED = re.compile('Failed to implant checksum')
+RE_UNKNOWN_FIELD = re.compile("Unknown field 'extra' in grub_template")
+
+
+class _ListHandler(logging.Handler):
+    """
+    Logging handler that keeps records in a list
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _Recorder:
+    """
+    Lightweight stand-in for subprocess.run() that records calls
+
+    side_effect can be an exception to raise or a callable to pass the arguments to
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.side_effect = None
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+        if isinstance(self.side_effect, BaseException):
+            raise self.side_effect
+
+        if self.side_effect is not None:
+            self.side_effect(*args, **kwargs)
+
+        return subprocess.CompletedProcess(args[0], 0)
+
+    def reset(self):
+        """
+        Clear recorded calls and side effect
+        """
+
+        self.calls.clear()
+        self.side_effect = None
+
 
 class TestInit(unittest.TestCase):
     """
     Tests for isomer.ISO initialization
     """
 
-    def setUp(self):
-        self.iso_partial = functools.partial(
-            isomer.ISO, source=TESTDATA, outfile='test.iso', volume_id='test_1_2_3'
+    @classmethod
+    def setUpClass(cls):
+
+        cls.iso_partial = functools.partial(
+            ISO, source=TESTDATA, outfile='test.iso', volume_id='test_1_2_3'
         )
 
+        # Shared instance for tests that only parse configuration
+        # Working directory is provided, so copies don't remove it
+        working = TemporaryDirectory(prefix='isomer_test_')  # pylint: disable=consider-using-with
+        cls.addClassCleanup(working.cleanup)
+        cls._template = cls.iso_partial(working=working.name, config={})
+
+    def _make(self, config):
+        """
+        Copy shared instance and parse configuration, skipping the constructor
+        """
+
+        iso = copy.copy(self._template)
+        iso.parse_config(config)
+
+        return iso
+
     def test_defaults(self):
         """Test with only required values"""
 
@@ -73,14 +152,32 @@ class TestInit(unittest.TestCase):
         # fields only contains volume_id
         self.assertEqual(iso.fields, {'volume_id': 'test_1_2_3'})
 
+        # jobs is default
+        self.assertEqual(iso.jobs, DEF_JOBS)
+
+    def test_context_manager(self):
+        """Temporary working directory is removed on exit"""
+
+        with self.iso_partial(config={}) as iso:
+            self.assertTrue(iso.working.is_dir())
+
+        self.assertFalse(iso.working.exists())
+
+        # Provided working directory is not removed
+        with TemporaryDirectory(prefix='isomer_test_') as working:
+            with self.iso_partial(working=working, config={}) as iso:
+                pass
+
+            self.assertTrue(iso.working.is_dir())
+
     def test_source(self):
         """source errors"""
 
         # Happy path in defaults
 
         # Does not exist
-        with self.assertRaisesRegex(ValueError, 'directory does not exist'):
-            isomer.ISO(
+        with self.assertRaisesRegex(ValueError, RE_NO_DIR):
+            ISO(
                 source='/path/does/not/exist', outfile='test.iso',
                 config={'volume_id': 'test_1_2_3'}
             )
@@ -94,6 +191,8 @@ class TestInit(unittest.TestCase):
         (working / 'file1').touch()  # File
         (working / 'dir1').mkdir()  # Directory
         (working / 'dir1' / 'file2').touch()  # Nested File
+        (working / 'dir1' / 'dir2').mkdir()  # Nested Directory
+        (working / 'dir1' / 'dir2' / 'ln_file').symlink_to(working / 'file1')  # Nested Symlink
 
         _target = TemporaryDirectory(prefix='isomer_test_')  # pylint: disable=consider-using-with
         target_dir = Path(_target.name)
@@ -108,8 +207,8 @@ class TestInit(unittest.TestCase):
 
         self.assertEqual(iso.working, working)
 
-        # Make sure directory was cleared correctly
-        isomer.clean_dir(working)
+        # Make sure directory was cleared correctly, without emptying symlink targets
+        clean_dir(working)
         self.assertEqual(os.listdir(working), [])
         self.assertTrue(target_dir.is_dir())
         self.assertTrue(target_file.is_file())
@@ -119,41 +218,54 @@ class TestInit(unittest.TestCase):
         _target.cleanup()
 
         # Directory does not exist
-        with self.assertRaisesRegex(ValueError, 'does not exist'):
+        with self.assertRaisesRegex(ValueError, RE_NO_DIR):
             self.iso_partial(working='some/dir/path', config={})
 
+    def test_jobs(self):
+        """jobs provided"""
+
+        # Happy path
+        iso = self.iso_partial(jobs=2, config={})
+        self.assertEqual(iso.jobs, 2)
+
+        # Not positive
+        with self.assertRaisesRegex(ValueError, RE_JOBS):
+            self.iso_partial(jobs=0, config={})
+
+        # Not an integer
+        with self.assertRaisesRegex(ValueError, RE_JOBS):
+            self.iso_partial(jobs='2', config={})
+
     def test_exclude(self):
         """exclude provided"""
 
-        # Single item coerced to list
-        iso = self.iso_partial(config={'exclude': 'foo'})
-        self.assertEqual(iso.exclude, ['foo'])
-
-        # Tuple coerced to list
-        iso = self.iso_partial(config={'exclude': ('foo',)})
-        self.assertEqual(iso.exclude, ['foo'])
+        # Single item and tuple coerced to list
+        for exclude in ('foo', ('foo',)):
+            with self.subTest(exclude=exclude):
+                iso = self._make({'exclude': exclude})
+                self.assertEqual(iso.exclude, ['foo'])
 
     def test_grub_template(self):
         """grub_template provided"""
 
-        iso = self.iso_partial(config={'grub_template': 'foo'})
+        iso = self._make({'grub_template': 'foo'})
 
         # grub_template is populated
         self.assertEqual(iso.grub_template, 'foo')
 
         # GRUB path is excluded
-        self.assertEqual(iso.exclude, [isomer.GRUB_REL_PATH])
+        self.assertEqual(iso.exclude, [GRUB_REL_PATH])
 
     def test_include(self):
         """include provided"""
 
         # Happy path
-        iso = self.iso_partial(config={'include': {'foo': 'bar'}})
+        iso = self._make({'include': {'foo': 'bar'}})
         self.assertEqual(iso.include, {'foo': 'bar'})
 
         # Not a dictionary
-        with self.assertRaisesRegex(TypeError, 'must be a dict'):
-            iso = self.iso_partial(config={'include': 'foo'})
+        with self.assertRaisesRegex(TypeError, RE_NOT_DICT):
+            iso = self._make({'include': 'foo'})
 
     def test_outfile(self):
         """output file provided"""
@@ -163,7 +275,7 @@ class TestInit(unittest.TestCase):
         self.assertEqual(iso.outfile, TESTDATA)
 
         # Parent doesn't exist
-        with self.assertRaisesRegex(ValueError, 'directory does not exist'):
+        with self.assertRaisesRegex(ValueError, RE_NO_DIR):
             iso = self.iso_partial(outfile='/not/a/real/path/test.iso', config={})
 
     def test_volume_id(self):
@@ -172,55 +284,52 @@ class TestInit(unittest.TestCase):
         # Happy path in defaults
 
         # Not provide
-        with self.assertRaisesRegex(TypeError, "Missing required field: 'volume_id'"):
-            isomer.ISO(source=TESTDATA, outfile='test.iso', config={})
+        with self.assertRaisesRegex(TypeError, RE_NO_VOLUME_ID):
+            ISO(source=TESTDATA, outfile='test.iso', config={})
 
         # Not a string
-        with self.assertRaisesRegex(TypeError, 'volume_id must be a str'):
-            isomer.ISO(source=TESTDATA, outfile='test.iso', config={'volume_id': [1, 2, 3]})
+        with self.assertRaisesRegex(TypeError, RE_VOLUME_ID_TYPE):
+            ISO(source=TESTDATA, outfile='test.iso', config={'volume_id': [1, 2, 3]})
 
         # Contains whitespace
-        with self.assertRaisesRegex(ValueError, 'contains whitespace'):
-            isomer.ISO(source=TESTDATA, outfile='test.iso', config={'volume_id': 'test 1 2 3'})
+        with self.assertRaisesRegex(ValueError, RE_WHITESPACE):
+            ISO(source=TESTDATA, outfile='test.iso', config={'volume_id': 'test 1 2 3'})
 
     def test_kickstart(self):
         """kickstart provided"""
 
         # Happy path
-        iso = self.iso_partial(config={'kickstart': KICKSTART})
-        self.assertEqual(iso.include, {isomer.KS_REL_PATH: KICKSTART})
+        iso = self._make({'kickstart': KICKSTART})
+        self.assertEqual(iso.include, {KS_REL_PATH: KICKSTART})
         self.assertEqual(
-            iso.fields, {'volume_id': 'test_1_2_3', 'ks_path': isomer.KS_REL_PATH}
+            iso.fields, {'volume_id': 'test_1_2_3', 'ks_path': KS_REL_PATH}
         )
 
         # Override
-        iso = self.iso_partial(config={'kickstart': KICKSTART, 'ks_path': '/foo/ks'})
+        iso = self._make({'kickstart': KICKSTART, 'ks_path': '/foo/ks'})
         self.assertEqual(iso.include, {'/foo/ks': KICKSTART})
         self.assertEqual(
             iso.fields, {'volume_id': 'test_1_2_3', 'ks_path': '/foo/ks'}
         )
 
         # Doesn't exist
-        with self.assertRaisesRegex(ValueError, 'Unable to find'):
-            iso = self.iso_partial(config={'kickstart': '/not/a/real/path/test.iso'})
+        with self.assertRaisesRegex(ValueError, RE_NOT_FOUND):
+            iso = self._make({'kickstart': '/not/a/real/path/test.iso'})
 
     def test_booleans(self):
         """Booleans provided"""
 
-        iso = self.iso_partial(config={'checksum': True, 'bios_boot': True, 'efi_boot': True})
-        self.assertTrue(iso.checksum)
-        self.assertTrue(iso.bios_boot)
-        self.assertTrue(iso.efi_boot)
-
-        iso = self.iso_partial(config={'checksum': False, 'bios_boot': False, 'efi_boot': False})
-        self.assertFalse(iso.checksum)
-        self.assertFalse(iso.bios_boot)
-        self.assertFalse(iso.efi_boot)
+        for value in (True, False):
+            with self.subTest(value=value):
+                iso = self._make({'checksum': value, 'bios_boot': value, 'efi_boot': value})
+                self.assertIs(iso.checksum, value)
+                self.assertIs(iso.bios_boot, value)
+                self.assertIs(iso.efi_boot, value)
 
     def test_extra_fields(self):
         """extra_fields provided"""
 
-        iso = self.iso_partial(config={'extra_fields': {'foo': 1, 'bar': 'two', 'doo': (1, 2, 3)}})
+        iso = self._make({'extra_fields': {'foo': 1, 'bar': 'two', 'doo': (1, 2, 3)}})
         self.assertEqual(
             iso.fields, {'volume_id': 'test_1_2_3', 'foo': 1, 'bar': 'two', 'doo': (1, 2, 3)}
         )
@@ -228,12 +337,10 @@ class TestInit(unittest.TestCase):
     def test_unsupported_fields(self):
         """Warn on unsupported fields"""
 
-        with self.assertLogs(isomer.LOGGER, logging.WARNING) as logs:
-            self.iso_partial(config={'foo': 'bar', 'spam': 'eggs'})
+        with self.assertLogs(LOGGER, logging.WARNING) as logs:
+            self._make({'foo': 'bar', 'spam': 'eggs'})
 
-        self.assertRegex(
-            logs.output[0], "Ignoring unsupported fields in flavor configuration: foo, spam"
-        )
+        self.assertRegex(logs.output[0], RE_UNSUPPORTED)
 
 
 class TestPopulateWorking(unittest.TestCase):
@@ -241,31 +348,47 @@ class TestPopulateWorking(unittest.TestCase):
     Tests for isomer.ISO.populate_working()
     """
 
+    _base_kwargs = {
+        'quiet': True, 'source': TEST_SRC, 'volume_id': 'test_1_2_3', 'outfile': 'test.iso'
+    }
+
+    @classmethod
+    def setUpClass(cls):
+
+        # Working directories for all tests are removed together
+        root = TemporaryDirectory(prefix='isomer_test_')  # pylint: disable=consider-using-with
+        cls.addClassCleanup(root.cleanup)
+        cls._root = root.name
+
+        # xorrisofs is replaced for all tests and reset for each
+        patcher = patch('subprocess.run', _Recorder())
+        cls.xorrisofs = patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
+        # Errors are captured and nothing is passed on to other handlers
+        cls.log_handler = _ListHandler(logging.ERROR)
+        LOGGER.addHandler(cls.log_handler)
+        cls.addClassCleanup(LOGGER.removeHandler, cls.log_handler)
+        cls.addClassCleanup(setattr, LOGGER, 'propagate', LOGGER.propagate)
+        LOGGER.propagate = False
+
     def setUp(self):
-        self.log_level = isomer.LOGGER.level
-        isomer.LOGGER.setLevel(logging.CRITICAL)
 
-        self._wdr = TemporaryDirectory(prefix='isomer_test_')  # pylint: disable=consider-using-with
-        self.working = Path(self._wdr.name)
+        self.log_handler.records.clear()
+        self.xorrisofs.reset()
+        self.checksum_runner = Mock(return_value=0)
+
+        self.working = Path(mkdtemp(dir=self._root))
         self.iso_partial = functools.partial(
-            isomer.ISO, quiet=True, source=TEST_SRC, volume_id='test_1_2_3',
-            outfile='test.iso', working=self.working
+            ISO, working=self.working, checksum_runner=self.checksum_runner,
+            **self._base_kwargs
         )
 
-    def tearDown(self):
-        isomer.LOGGER.setLevel(self.log_level)
-        self._wdr.cleanup()
-
     def test_defaults(self):
         """Test with minimal configuration"""
 
         iso = self.iso_partial(config={})
-        with patch('subprocess.run') as xorrisofs:
-            with patch('subprocess.Popen') as implantisomd5:
-                with implantisomd5() as process:
-                    process.poll.side_effect = (None, 0)
-                    process.returncode = 0
-                    iso.generate()
+        iso.generate()
 
         # Check directories match
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
@@ -274,27 +397,84 @@ class TestPopulateWorking(unittest.TestCase):
         self.assertCountEqual(working_only, [])
 
         self.assertEqual(
-            xorrisofs.call_args.args[0],
+            self.xorrisofs.calls[-1][0][0],
             ['xorrisofs', '-v', '-follow-links', '-J', '-joliet-long', '-r', '-U', '-V',
              'test_1_2_3', '-e', 'images/efiboot.img', '-no-emul-boot', '-o',
              'test.iso', str(self.working)])
 
+        self.checksum_runner.assert_called_once_with('test.iso')
+
+    def test_jobs(self):
+        """Threads are only started when links are created with more than one job"""
+
+        for jobs, path_list, threaded in ((DEF_JOBS, False, True), (1, False, False),
+                                          (DEF_JOBS, True, False)):
+            with self.subTest(jobs=jobs, path_list=path_list):
+                iso = self.iso_partial(jobs=jobs, path_list=path_list, config={})
+                with patch('isomer.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as executor:
+                    iso.populate_working()
+
+                self.assertEqual(executor.called, threaded)
+                differ, src_only, _ = compare_dirs(TEST_SRC, self.working)
+                self.assertCountEqual(differ, [])
+                if not path_list:
+                    self.assertCountEqual(src_only, [])
+
+    def test_reassigned_paths(self):
+        """Paths changed after initialization are used for the build"""
+
+        iso = self.iso_partial(config={})
+        iso.working = Path(mkdtemp(dir=self._root))
+        iso.outfile = Path('other.iso')
+        iso.generate()
+
+        # Original working directory is untouched
+        self.assertEqual(os.listdir(self.working), [])
+        differ, src_only, working_only = compare_dirs(TEST_SRC, iso.working)
+        self.assertCountEqual(differ, [])
+        self.assertCountEqual(src_only, [])
+        self.assertCountEqual(working_only, [])
+
+        self.assertEqual(self.xorrisofs.calls[-1][0][0][-3:], ['-o', 'other.iso', str(iso.working)])
+        self.checksum_runner.assert_called_once_with('other.iso')
+
+    def test_implantisomd5(self):
+        """Default checksum runner calls implantisomd5"""
+
+        iso = self.iso_partial(config={}, checksum_runner=None)
+        with patch('subprocess.Popen') as implantisomd5:
+            process = implantisomd5.return_value.__enter__.return_value
+            process.returncode = 0
+            iso.generate()
+
         self.assertEqual(implantisomd5.call_args.args[0], ('implantisomd5', 'test.iso'))
+        self.assertEqual(implantisomd5.call_args.kwargs['stdout'], subprocess.DEVNULL)
+        process.wait.assert_called_once()
 
     def test_no_quiet(self):
         """Test with quiet disabled"""
 
-        iso = isomer.ISO(
+        iso = ISO(
             source=TEST_SRC, outfile='test.iso', working=self.working, config={'volume_id': '4_5_6'}
         )
 
-        with patch('subprocess.run'):
-            with redirect_stdout(StringIO()) as output:
-                with patch('subprocess.Popen') as implantisomd5:
-                    with implantisomd5() as process:
-                        process.poll.side_effect = (None, 0)
-                        process.returncode = 0
-                        iso.generate()
+        # Simulated implantisomd5 output, pipe is closed when process exits
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'md5 = 1234\n')
+        os.close(write_fd)
+
+        with patch('subprocess.Popen') as implantisomd5:
+            process = implantisomd5.return_value.__enter__.return_value
+            process.returncode = 0
+
+            with redirect_stdout(StringIO()) as output, open(read_fd, 'rb', buffering=0) as stdout:
+                process.stdout = stdout
+
+                # Time out once before output is read
+                with patch.object(
+                    selectors.DefaultSelector, 'select', side_effect=([], [1], [1])
+                ):
+                    iso.generate()
 
         # Check directories match
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
@@ -302,27 +482,23 @@ class TestPopulateWorking(unittest.TestCase):
         self.assertCountEqual(src_only, [])
         self.assertCountEqual(working_only, [])
 
-        self.assertRegex(output.getvalue(), 'Calculating md5sum')
+        self.assertEqual(output.getvalue(), 'Calculating md5sum: .md5 = 1234\n')
+        self.assertEqual(implantisomd5.call_args.kwargs['stdout'], subprocess.PIPE)
+        process.wait.assert_called_once()
 
     def test_checksum_fails(self):
         """Checksum command fails"""
 
-        iso = self.iso_partial(config={})
-        with patch('subprocess.run'):
-            with patch('subprocess.Popen') as implantisomd5:
-                with implantisomd5() as process:
-                    process.returncode = 5
-                    with self.assertLogs(isomer.LOGGER, logging.ERROR) as logs:
-                        iso.generate()
+        iso = self.iso_partial(config={}, checksum_runner=lambda outfile: 5)
+        iso.generate()
 
-        self.assertRegex(logs.output[0], 'Failed to implant checksum')
+        self.assertRegex(self.log_handler.records[0].getMessage(), RE_CHECKSUM_FAILED)
 
     def test_exclude(self):
         """Test excluded files"""
 
         iso = self.iso_partial(config={'exclude': ('foo', 'misc')})
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            iso.generate()
+        iso.generate()
 
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
         self.assertCountEqual(differ, [])
@@ -336,8 +512,9 @@ class TestPopulateWorking(unittest.TestCase):
             'include': {'foo': FLAVOR_PATH, 'misc/test': FLAVOR2_PATH, 'Base': TEST_SRC / 'Apps'}
         })
 
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            iso.generate()
+        # Generate twice to make sure include isn't consumed
+        iso.generate()
+        iso.generate()
 
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
         self.assertCountEqual(differ, ['Base', 'foo'])
@@ -349,27 +526,27 @@ class TestPopulateWorking(unittest.TestCase):
 
         iso = self.iso_partial(config={'kickstart': KICKSTART})
 
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            iso.generate()
+        iso.generate()
 
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
         self.assertCountEqual(differ, [])
         self.assertCountEqual(src_only, [])
         self.assertCountEqual(working_only, ['ks.cfg'])
 
-        self.assertEqual(Path(os.readlink(self.working / 'ks.cfg')), KICKSTART)
+        # Path.readlink() requires Python 3.9
+        ks_path = self.working / KS_REL_PATH
+        self.assertTrue(ks_path.is_symlink())
+        self.assertEqual(os.readlink(ks_path), os.fspath(KICKSTART))
 
     def test_swap_boot(self):
         """Swap EFI boot for BIOS"""
 
         iso = self.iso_partial(config={'bios_boot': True, 'efi_boot': False})
 
-        with patch('subprocess.run') as xorrisofs:
-            with patch('subprocess.Popen'):
-                iso.generate()
+        iso.generate()
 
         self.assertEqual(
-            xorrisofs.call_args.args[0],
+            self.xorrisofs.calls[-1][0][0],
             ['xorrisofs', '-v', '-follow-links', '-J', '-joliet-long', '-r', '-U', '-V',
              'test_1_2_3',
              '-b', 'isolinux/isolinux.bin', '-c', 'isolinux/boot.cat', '-no-emul-boot',
@@ -383,24 +560,121 @@ class TestPopulateWorking(unittest.TestCase):
             config={'grub_template': '{volume_id}, {extra}', 'extra_fields': {'extra': 'foobar'}}
         )
 
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            iso.generate()
+        iso.generate()
 
         differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
-        self.assertCountEqual(differ, [isomer.GRUB_REL_PATH])
+        self.assertCountEqual(differ, [GRUB_REL_PATH])
         self.assertCountEqual(src_only, [])
         self.assertCountEqual(working_only, [])
 
         self.assertEqual(
-            (self.working / isomer.GRUB_REL_PATH).read_text(),
+            (self.working / GRUB_REL_PATH).read_text(),
             'test_1_2_3, foobar'
         )
 
+    def test_source_symlinks(self):
+        """Symlinked directories in source are created empty like os.walk(), others are linked"""
+
+        with TemporaryDirectory(prefix='isomer_test_') as source:
+            source = Path(source)
+            (source / 'Packages').symlink_to(TEST_SRC / 'Apps')
+            (source / 'foo').symlink_to(TEST_SRC / 'foo')
+            (source / 'loop').symlink_to(source)
+
+            iso = self.iso_partial(
+                source=source, config={'include': {'Packages/extra': FLAVOR_PATH}}
+            )
+            iso.generate()
+
+            self.assertCountEqual(os.listdir(self.working), ['Packages', 'foo', 'loop'])
+            self.assertEqual(Path(os.readlink(self.working / 'foo')), source / 'foo')
+
+            # Symlinked directories aren't walked, includes are added to the created directory
+            for name in ('Packages', 'loop'):
+                self.assertFalse((self.working / name).is_symlink())
+            self.assertEqual(os.listdir(self.working / 'loop'), [])
+            self.assertEqual(os.listdir(self.working / 'Packages'), ['extra'])
+            self.assertEqual(Path(os.readlink(self.working / 'Packages' / 'extra')), FLAVOR_PATH)
+
+        # Symlink target is unchanged
+        self.assertCountEqual(os.listdir(TEST_SRC / 'Apps'), ['rpm1', 'rpm2'])
+
+    def test_include_no_follow(self):
+        """Included files are never linked through symlinks in working"""
+
+        iso = self.iso_partial(config={'include': {
+            'Base': TEST_SRC / 'Apps',
+            'Base/extra': FLAVOR_PATH,
+        }})
+
+        # Error depends on the platform, but nothing is created through the symlink
+        with self.assertRaisesRegex(OSError, '^.+ Unable to include Base/extra: '):
+            iso.generate()
+
+        # Symlink target is unchanged and ISO isn't created
+        self.assertCountEqual(os.listdir(TEST_SRC / 'Apps'), ['rpm1', 'rpm2'])
+        self.assertEqual(self.xorrisofs.calls, [])
+
+    def test_include_invalid_path(self):
+        """Included paths must be relative to the ISO root"""
+
+        for path in ('/certs/ca.crt', '', '.', '../outside', 'misc/../../outside'):
+            with self.subTest(path=path):
+                iso = self.iso_partial(config={'include': {path: FLAVOR2_PATH}})
+                with self.assertRaisesRegex(ValueError, f'^Unable to include {path}: Invalid'):
+                    iso.generate()
+
+        # Nothing is created outside of working
+        self.assertFalse((self.working.parent / 'outside').exists())
+        self.assertEqual(self.xorrisofs.calls, [])
+
+    def test_path_list(self):
+        """Files are grafted with a path list rather than linked"""
+
+        iso = self.iso_partial(
+            path_list=True, config={'exclude': 'misc', 'include': {'Base': TEST_SRC / 'Apps'}}
+        )
+
+        path_lists = []
+
+        def xorrisofs(args, **_):
+            path_lists.append(Path(args[args.index('-path-list') + 1]).read_text('utf-8'))
+
+        self.xorrisofs.side_effect = xorrisofs
+        iso.generate()
+
+        # Only directories are created
+        differ, src_only, working_only = compare_dirs(TEST_SRC, self.working)
+        self.assertCountEqual(differ, [])
+        self.assertCountEqual(
+            src_only, ['Apps/rpm1', 'Apps/rpm2', 'Base', 'Base/rpm3', 'EFI/BOOT/grub.cfg', 'foo',
+                       'misc', 'misc/bar']
+        )
+        self.assertCountEqual(working_only, [])
+
+        args = self.xorrisofs.calls[-1][0][0]
+        self.assertEqual(
+            args[-6:],
+            ['-graft-points', '-path-list', args[-4], '-o', 'test.iso', str(self.working)]
+        )
+
+        self.assertCountEqual(path_lists[0].splitlines(), [
+            f'Apps/rpm1={TEST_SRC / "Apps" / "rpm1"}',
+            f'Apps/rpm2={TEST_SRC / "Apps" / "rpm2"}',
+            f'Base={TEST_SRC / "Apps"}',
+            f'EFI/BOOT/grub.cfg={TEST_SRC / "EFI" / "BOOT" / "grub.cfg"}',
+            f'foo={TEST_SRC / "foo"}',
+        ])
+
+        # Path list is removed
+        self.assertFalse(Path(args[-4]).exists())
+
     def test_grub_no_dir(self):
         """Test grub generation (no directory)"""
 
-        iso = isomer.ISO(
+        iso = ISO(
             quiet=True, source=TEST_SRC / 'misc', outfile='test.iso', working=self.working,
+            checksum_runner=self.checksum_runner,
             config={
                 'volume_id': '45_6',
                 'grub_template': '{volume_id}, {extra}',
@@ -408,8 +682,7 @@ class TestPopulateWorking(unittest.TestCase):
             }
         )
 
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            iso.generate()
+        iso.generate()
 
         differ, src_only, working_only = compare_dirs(TEST_SRC / 'misc', self.working)
         self.assertCountEqual(differ, [])
@@ -417,7 +690,7 @@ class TestPopulateWorking(unittest.TestCase):
         self.assertCountEqual(working_only, ['EFI'])
 
         self.assertEqual(
-            (self.working / isomer.GRUB_REL_PATH).read_text(),
+            (self.working / GRUB_REL_PATH).read_text(),
             '45_6, foobar'
         )
 
@@ -428,22 +701,121 @@ class TestPopulateWorking(unittest.TestCase):
             config={'grub_template': '{volume_id}, {extra}'}
         )
 
-        with patch('subprocess.run'), patch('subprocess.Popen'):
-            with self.assertLogs(isomer.LOGGER, logging.ERROR) as logs:
-                iso.generate()
+        iso.generate()
 
-        self.assertRegex(
-            logs.output[0], "Unknown field 'extra' in grub_template"
-        )
+        self.assertRegex(self.log_handler.records[0].getMessage(), RE_UNKNOWN_FIELD)
+
+        # No file is written
+        self.assertFalse((self.working / GRUB_REL_PATH).exists())
 
     def test_xorrisofs_fails(self):
         """xorrisofs command fails"""
 
         iso = self.iso_partial(config={})
-        with patch('subprocess.run') as xorrisofs:
-            with patch('subprocess.Popen') as implantisomd5:
-                xorrisofs.side_effect = subprocess.CalledProcessError(2, 'xorrisofs')
-                iso.generate()
+        self.xorrisofs.side_effect = subprocess.CalledProcessError(2, 'xorrisofs')
+
+        # Working directory contents aren't checked, so skip populating it
+        with patch.object(ISO, 'populate_working') as populate_working:
+            iso.generate()
+
+        populate_working.assert_called_once()
+
+        self.assertEqual(len(self.xorrisofs.calls), 1)
+        self.checksum_runner.assert_not_called()
+
+
+class TestCleanDir(unittest.TestCase):
+    """
+    Tests for isomer.clean_dir()
+    """
+
+    def test_no_follow(self):
+        """Symlinks are unlinked, not followed"""
+
+        with TemporaryDirectory(prefix='isomer_test_') as working:
+            working = Path(working)
+            (working / 'file1').touch()
+            (working / 'dir1').mkdir()
+            (working / 'ln_dir').symlink_to(TEST_SRC)  # Symlink to Directory
+            (working / 'dir1' / 'ln_file').symlink_to(TEST_SRC / 'foo')  # Nested Symlink
+
+            # Nothing is removed, so targets would be listed if they were followed
+            with patch('os.unlink') as unlink, patch('os.rmdir') as rmdir:
+                clean_dir(working)
+
+        self.assertCountEqual(
+            [call.args[0] for call in unlink.call_args_list], ['file1', 'ln_dir', 'ln_file']
+        )
+        self.assertEqual([call.args[0] for call in rmdir.call_args_list], ['dir1'])
+
+
+class TestCompileExcludes(unittest.TestCase):
+    """
+    Tests for isomer._compile_excludes()
+    """
+
+    def test_matches_pathlib(self):
+        """Patterns match the same paths as pathlib.PurePath.match()"""
+
+        paths = (
+            'foo', 'misc', 'misc/bar', 'a/b/c.rpm', 'EFI/BOOT/grub.cfg', 'x/[a]', 'a.b', 'ab',
+            'dir/-', 'a/.hidden', 'a/b!c', 'a|b', 'z', 'b', 'ab-',
+        )
+        patterns = (
+            'foo', 'misc', '*.rpm', 'b/*.rpm', 'a/*', '*', '*/*', 'EFI/BOOT/grub.cfg',
+            'BOOT/grub.cfg', '[ab]*', '[!a]*', '[]', '[', 'a?b', '?', '[.-0]', 'x/[[]a]',
+            'a/./b/*', '**', 'a*/c.rpm', '[!b]', '.*', '[^a]*', 'a[|]b', '/foo',
+            '[z-a]*', '[b-a]', '[c-?]', '[.?--]', '[!z-a]', '[--/]', '[a-]', 'a[a-c-b]',
+        )
+
+        for pattern in patterns:
+            exclude_re = isomer._compile_excludes((pattern,))  # pylint: disable=protected-access
+            for path in paths:
+                with self.subTest(pattern=pattern, path=path):
+                    self.assertEqual(
+                        bool(exclude_re and exclude_re.search(path)), PurePath(path).match(pattern)
+                    )
+
+    def test_multiple(self):
+        """Multiple patterns are combined"""
+
+        exclude_re = isomer._compile_excludes(('foo', '*.rpm'))  # pylint: disable=protected-access
+        self.assertTrue(exclude_re.search('foo'))
+        self.assertTrue(exclude_re.search('Apps/rpm1.rpm'))
+        self.assertFalse(exclude_re.search('Apps/rpm1'))
+
+    def test_none(self):
+        """No patterns which can match"""
+
+        self.assertIsNone(isomer._compile_excludes(()))  # pylint: disable=protected-access
+        self.assertIsNone(isomer._compile_excludes(('/foo',)))  # pylint: disable=protected-access
+
+    def test_cached(self):
+        """Compiled patterns are reused"""
+
+        # pylint: disable=protected-access
+        self.assertIs(isomer._compile_excludes(('foo', 'bar')),
+                      isomer._compile_excludes(('foo', 'bar')))
+
+    def test_empty(self):
+        """Empty pattern"""
+
+        with self.assertRaisesRegex(ValueError, 'Empty exclude pattern'):
+            isomer._compile_excludes(('',))  # pylint: disable=protected-access
+
+
+class TestEscapeGraft(unittest.TestCase):
+    """
+    Tests for isomer._escape_graft()
+    """
+
+    def test_escape(self):
+        """Special characters are escaped"""
+
+        # pylint: disable=protected-access
+        self.assertEqual(isomer._escape_graft('foo/bar'), 'foo/bar')
+        self.assertEqual(isomer._escape_graft(Path('foo=bar')), 'foo\\=bar')
+        self.assertEqual(isomer._escape_graft('foo\\bar'), 'foo\\\\bar')
 
-        xorrisofs.assert_called_once()
-        implantisomd5.assert_not_called()
+        with self.assertRaisesRegex(ValueError, 'containing a newline'):
+            isomer._escape_graft('foo\nbar')